@@ -3,17 +3,19 @@ __copyright__ = "Copyright 2023, David Lähnemann, Johannes Köster, Christian M
 __email__ = "johannes.koester@uni-due.de"
 __license__ = "MIT"
 
+import asyncio
 import atexit
-import csv
-from io import StringIO
+import logging
 import os
 from pathlib import Path
 import re
 import shlex
 import subprocess
+import tempfile
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass, field
-from datetime import datetime, timedelta
 from typing import List, Generator, Optional
 import uuid
 from snakemake_interface_executor_plugins.executors.base import SubmittedJobInfo
@@ -30,6 +32,29 @@ from snakemake_executor_plugin_slurm_jobstep import get_cpus_per_task
 
 from .utils import delete_slurm_environment, delete_empty_dirs
 
+# upper limit of sbatch (or scancel) calls waiting for slurmctld at the
+# same time, when submitting (or cancelling) several jobs at once
+MAX_CONCURRENT_SUBMISSIONS = 8
+# upper limit of job ids passed to a single SLURM command (sacct, scancel)
+MAX_JOBIDS_PER_COMMAND = 500
+# job id in the output of sbatch, either as "<id>[;<cluster>]" (--parsable)
+# or as "Submitted batch job <id>[ on cluster <cluster>]"
+SBATCH_JOBID_RE = re.compile(r"(?:^|Submitted batch job)\s*(\d+)", re.MULTILINE)
+# SLURM job states indicating that a job has failed
+# (PREEMPTED is handled separately, as preempted jobs may be requeued)
+FAIL_STATI = frozenset(
+    {
+        "BOOT_FAIL",
+        "CANCELLED",
+        "DEADLINE",
+        "FAILED",
+        "NODE_FAIL",
+        "OUT_OF_MEMORY",
+        "TIMEOUT",
+        "ERROR",
+    }
+)
+
 
 @dataclass
 class ExecutorSettings(ExecutorSettingsBase):
@@ -85,6 +110,18 @@ class ExecutorSettings(ExecutorSettingsBase):
             "required": False,
         },
     )
+    squeue_interval: Optional[int] = field(
+        default=None,
+        metadata={
+            "help": "If set, a single background 'squeue --iterate' process "
+            "reports the state of queued and running jobs of the workflow "
+            "every given number of seconds. 'sacct' is then only queried for "
+            "jobs, which already left the queue. Per default, the state of "
+            "all jobs is queried with 'sacct'.",
+            "env_var": False,
+            "required": False,
+        },
+    )
 
 
 # Required:
@@ -119,10 +156,52 @@ class Executor(RemoteExecutor):
         self.warn_on_jobcontext()
         self.run_uuid = str(uuid.uuid4())
         self.logger.info(f"SLURM run ID: {self.run_uuid}")
+        # whether debug messages are shown at all: the Snakemake 8 logger wraps
+        # a standard logger, later versions hand one to the executor directly
+        logger = getattr(self.logger, "logger", self.logger)
+        self._debug_logging = not hasattr(logger, "isEnabledFor") or (
+            logger.isEnabledFor(logging.DEBUG)
+        )
+        # generic part of a submission string, which is the same for all jobs:
+        # we use a run_uuid as the job-name, to allow `--name`-based
+        # filtering of the jobs of a run (`sacct --name` and `squeue --name`)
+        self._sbatch_prefix = (
+            "sbatch",
+            "--parsable",
+            "--job-name",
+            self.run_uuid,
+            "--export=ALL",
+        )
         self._fallback_account_arg = None
-        self._fallback_partition = None
+        # default partitions per (multi)cluster specification, with None
+        # being the cluster of the login node
+        self._fallback_partitions = {}
+        # the accounts of the user, queried once upon the first
+        # account test instead of for every submitted job
+        self._valid_accounts = None
         self._preemption_warning = False  # no preemption warning has been issued
-        self.slurm_logdir = None
+        self.slurm_logdir = (
+            Path(self.workflow.executor_settings.logdir)
+            if self.workflow.executor_settings.logdir
+            else Path(".snakemake/slurm_logs").resolve()
+        )
+        # this behavior has been fixed in slurm 23.02, but there might be plenty of
+        # older versions around, hence we should rather be conservative here.
+        assert "%j" not in str(self.slurm_logdir), (
+            "bug: jobid placeholder in parent dir of logfile. This does not work as "
+            "we have to create that dir before submission in order to make sbatch "
+            "happy. Otherwise we get silent fails without logfiles being created."
+        )
+        self._created_logdirs = set()
+        self._consecutive_status_misses = 0
+        # latest job states reported by a background 'squeue --iterate',
+        # along with the time they were obtained
+        self._squeue_snapshot = ({}, 0.0)
+        self._squeue_process = None
+        # set upon shutdown, when squeue is terminated on purpose
+        self._squeue_stopping = False
+        if self.workflow.executor_settings.squeue_interval:
+            self.start_squeue_stream()
         atexit.register(self.clean_old_logs)
 
     def clean_old_logs(self) -> None:
@@ -149,21 +228,47 @@ class Executor(RemoteExecutor):
         except (OSError, FileNotFoundError) as e:
             self.logger.warning(f"Could not delete empty directory {path}: {e}")
 
-    def warn_on_jobcontext(self, done=None):
-        if not done:
-            if "SLURM_JOB_ID" in os.environ:
-                self.logger.warning(
-                    "You are running snakemake in a SLURM job context. "
-                    "This is not recommended, as it may lead to unexpected behavior. "
-                    "Please run Snakemake directly on the login node."
-                )
-                time.sleep(5)
-                delete_slurm_environment()
-        done = True
+    def warn_on_jobcontext(self):
+        if "SLURM_JOB_ID" in os.environ:
+            self.logger.warning(
+                "You are running snakemake in a SLURM job context. "
+                "This is not recommended, as it may lead to unexpected behavior. "
+                "Please run Snakemake directly on the login node."
+            )
+            delete_slurm_environment()
 
     def additional_general_args(self):
         return "--executor slurm-jobstep --jobs 1"
 
+    def run_jobs(self, jobs: List[JobExecutorInterface]):
+        # Submitting a job is dominated by the time sbatch waits for slurmctld.
+        # Hence, we assemble the submission commands one after the other, but
+        # wait for up to MAX_CONCURRENT_SUBMISSIONS sbatch calls at a time.
+        # Reporting the submissions again happens sequentially.
+        self.prefetch_slurm_metadata(jobs)
+        if len(jobs) < 2:
+            super().run_jobs(jobs)
+            return
+        submissions = []
+        for job in jobs:
+            self.run_job_pre(job)
+            submissions.append((job, *self.get_submit_command(job)))
+        with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_SUBMISSIONS) as pool:
+            futures = [
+                pool.submit(self.submit, call, job_script)
+                for _, call, job_script, _ in submissions
+            ]
+        error = None
+        for (job, _, _, slurm_logfile), future in zip(submissions, futures):
+            # report all successful submissions before raising the first error,
+            # such that no submitted job remains unknown to Snakemake
+            try:
+                self.report_submission(job, future.result(), slurm_logfile)
+            except Exception as e:
+                error = error or e
+        if error is not None:
+            raise error
+
     def run_job(self, job: JobExecutorInterface):
         # Implement here how to run a job.
         # You can access the job's resources, etc.
@@ -172,7 +277,15 @@ class Executor(RemoteExecutor):
         # self.report_job_submission(job_info).
         # with job_info being of type
         # snakemake_interface_executor_plugins.executors.base.SubmittedJobInfo.
+        call, job_script, slurm_logfile = self.get_submit_command(job)
+        out = self.submit(call, job_script)
+        self.report_submission(job, out, slurm_logfile)
 
+    def get_submit_command(self, job: JobExecutorInterface):
+        """
+        returns the sbatch call for the given job as a list of arguments,
+        along with the job script and the path of its SLURM log file
+        """
         group_or_rule = f"group_{job.name}" if job.is_group() else f"rule_{job.name}"
 
         try:
@@ -180,50 +293,48 @@ class Executor(RemoteExecutor):
         except AttributeError:
             wildcard_str = ""
 
-        self.slurm_logdir = (
-            Path(self.workflow.executor_settings.logdir)
-            if self.workflow.executor_settings.logdir
-            else Path(".snakemake/slurm_logs").resolve()
-        )
-
-        self.slurm_logdir.mkdir(parents=True, exist_ok=True)
         slurm_logfile = self.slurm_logdir / group_or_rule / wildcard_str / "%j.log"
-        slurm_logfile.parent.mkdir(parents=True, exist_ok=True)
-        # this behavior has been fixed in slurm 23.02, but there might be plenty of
-        # older versions around, hence we should rather be conservative here.
-        assert "%j" not in str(self.slurm_logdir), (
-            "bug: jobid placeholder in parent dir of logfile. This does not work as "
-            "we have to create that dir before submission in order to make sbatch "
-            "happy. Otherwise we get silent fails without logfiles being created."
-        )
+        # many jobs share the same log directory, hence we only create
+        # each directory once and skip the file system calls afterwards
+        if slurm_logfile.parent not in self._created_logdirs:
+            slurm_logfile.parent.mkdir(parents=True, exist_ok=True)
+            self._created_logdirs.add(slurm_logfile.parent)
 
-        # generic part of a submission string:
-        # we use a run_uuid as the job-name, to allow `--name`-based
-        # filtering in the job status checks (`sacct --name` and `squeue --name`)
         if wildcard_str == "":
             comment_str = f"rule_{job.name}"
         else:
             comment_str = f"rule_{job.name}_wildcards_{wildcard_str}"
-        call = (
-            f"sbatch "
-            f"--parsable "
-            f"--job-name {self.run_uuid} "
-            f"--output '{slurm_logfile}' "
-            f"--export=ALL "
-            f"--comment {comment_str}"
-        )
+        # the submission command is assembled as an argument list, which is
+        # passed to sbatch without an intermediate shell
+        call = [
+            *self._sbatch_prefix,
+            "--output",
+            str(slurm_logfile),
+            "--comment",
+            comment_str,
+        ]
 
         call += self.get_account_arg(job)
         call += self.get_partition_arg(job)
 
         if self.workflow.executor_settings.requeue:
-            call += " --requeue"
+            call.append("--requeue")
+
+        # shorthands, to look up each resource only once:
+        resources = job.resources
+        clusters = resources.get("clusters")
+        runtime = resources.get("runtime")
+        constraint = resources.get("constraint")
+        mem_mb_per_cpu = resources.get("mem_mb_per_cpu")
+        mem_mb = resources.get("mem_mb")
+        nodes = resources.get("nodes")
+        slurm_extra = resources.get("slurm_extra")
 
-        if job.resources.get("clusters"):
-            call += f" --clusters {job.resources.clusters}"
+        if clusters:
+            call += ["--clusters", str(clusters)]
 
-        if job.resources.get("runtime"):
-            call += f" -t {job.resources.runtime}"
+        if runtime:
+            call += ["-t", str(runtime)]
         else:
             self.logger.warning(
                 "No wall time information given. This might or might not "
@@ -232,82 +343,98 @@ class Executor(RemoteExecutor):
                 "default via --default-resources."
             )
 
-        if job.resources.get("constraint"):
-            call += f" -C '{job.resources.constraint}'"
-        if job.resources.get("mem_mb_per_cpu"):
-            call += f" --mem-per-cpu {job.resources.mem_mb_per_cpu}"
-        elif job.resources.get("mem_mb"):
-            call += f" --mem {job.resources.mem_mb}"
+        if constraint:
+            call += ["-C", str(constraint)]
+        if mem_mb_per_cpu:
+            call += ["--mem-per-cpu", str(mem_mb_per_cpu)]
+        elif mem_mb:
+            call += ["--mem", str(mem_mb)]
         else:
             self.logger.warning(
                 "No job memory information ('mem_mb' or 'mem_mb_per_cpu') is given "
                 "- submitting without. This might or might not work on your cluster."
             )
 
-        if job.resources.get("nodes", False):
-            call += f" --nodes={job.resources.get('nodes', 1)}"
+        if nodes:
+            call.append(f"--nodes={nodes}")
 
         # fixes #40 - set ntasks regardless of mpi, because
         # SLURM v22.05 will require it for all jobs
-        call += f" --ntasks={job.resources.get('tasks', 1)}"
+        call.append(f"--ntasks={resources.get('tasks', 1)}")
         # MPI job
-        if job.resources.get("mpi", False):
-            if not job.resources.get("tasks_per_node") and not job.resources.get(
-                "nodes"
-            ):
+        if resources.get("mpi", False):
+            if not resources.get("tasks_per_node") and not nodes:
                 self.logger.warning(
                     "MPI job detected, but no 'tasks_per_node' or 'nodes' "
                     "specified. Assuming 'tasks_per_node=1'."
                     "Probably not what you want."
                 )
 
-        call += f" --cpus-per-task={get_cpus_per_task(job)}"
+        call.append(f"--cpus-per-task={get_cpus_per_task(job)}")
 
-        if job.resources.get("slurm_extra"):
-            self.check_slurm_extra(job)
-            call += f" {job.resources.slurm_extra}"
+        if slurm_extra:
+            try:
+                slurm_extra_args = shlex.split(slurm_extra)
+            except ValueError as e:
+                raise WorkflowError(
+                    f"Unable to parse the 'slurm_extra' parameter '{slurm_extra}': {e}"
+                )
+            self.check_slurm_extra(slurm_extra_args)
+            call += slurm_extra_args
 
         exec_job = self.format_job_exec(job)
 
         # ensure that workdir is set correctly
         # use short argument as this is the same in all slurm versions
         # (see https://github.com/snakemake/snakemake/issues/2014)
-        call += f" -D {self.workflow.workdir_init}"
-        # and finally the job to execute with all the snakemake parameters
-        call += f' --wrap="{exec_job}"'
+        call += ["-D", str(self.workflow.workdir_init)]
+        # and finally the job to execute with all the snakemake parameters:
+        # instead of using '--wrap' the job script is passed to sbatch via
+        # stdin, sbatch reads it from there if no script file is given
+        job_script = f"#!/bin/sh\n{exec_job}\n"
+        return call, job_script, slurm_logfile
 
-        self.logger.debug(f"sbatch call: {call}")
+    def submit(self, call, job_script):
+        """
+        runs the given sbatch call with the job script as its input and
+        returns its output, raises a WorkflowError if the submission failed
+        """
+        if self._debug_logging:
+            self.logger.debug(
+                f"sbatch call: {shlex.join(call)}\njob script:\n{job_script}"
+            )
         try:
-            process = subprocess.Popen(
-                call,
-                shell=True,
-                text=True,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
+            process = subprocess.run(
+                call, input=job_script, text=True, capture_output=True, check=True
             )
-            out, err = process.communicate()
-            if process.returncode != 0:
-                raise subprocess.CalledProcessError(
-                    process.returncode, call, output=err
-                )
-        except subprocess.CalledProcessError as e:
+        except (subprocess.CalledProcessError, OSError) as e:
             raise WorkflowError(
-                f"SLURM sbatch failed. The error message was {e.output}"
+                f"SLURM sbatch failed. The error message was {getattr(e, 'stderr', e)}"
             )
         # any other error message indicating failure?
-        if "submission failed" in err:
+        if "submission failed" in process.stderr:
             raise WorkflowError(
-                f"SLURM job submission failed. The error message was {err}"
+                "SLURM job submission failed. The error message was "
+                f"{process.stderr}"
             )
+        return process.stdout
 
+    def report_submission(self, job: JobExecutorInterface, out, slurm_logfile):
+        """
+        extracts the SLURM job id from the sbatch output and reports
+        the submission of the job
+        """
         # multicluster submissions yield submission infos like
         # "Submitted batch job <id> on cluster <name>" by default, but with the
         # --parsable option it simply yields "<id>;<name>".
-        # To extract the job id we split by semicolon and take the first element
+        # The regular expression extracts the job id from either format
         # (this also works if no cluster name was provided)
-        slurm_jobid = out.strip().split(";")[0]
-        if not slurm_jobid:
-            raise WorkflowError("Failed to retrieve SLURM job ID from sbatch output.")
+        match = SBATCH_JOBID_RE.search(out)
+        if match is None:
+            raise WorkflowError(
+                f"Failed to retrieve SLURM job ID from sbatch output: '{out.strip()}'"
+            )
+        slurm_jobid = match.group(1)
         slurm_logfile = slurm_logfile.with_name(
             slurm_logfile.name.replace("%j", slurm_jobid)
         )
@@ -337,16 +464,6 @@ class Executor(RemoteExecutor):
         #
         # async with self.status_rate_limiter:
         #    # query remote middleware here
-        fail_stati = (
-            "BOOT_FAIL",
-            "CANCELLED",
-            "DEADLINE",
-            "FAILED",
-            "NODE_FAIL",
-            "OUT_OF_MEMORY",
-            "TIMEOUT",
-            "ERROR",
-        )
         # Cap sleeping time between querying the status of all active jobs:
         # If `AccountingStorageType`` for `sacct` is set to `accounting_storage/none`,
         # sacct will query `slurmctld` (instead of `slurmdbd`) and this in turn can
@@ -358,65 +475,96 @@ class Executor(RemoteExecutor):
 
         sacct_query_durations = []
 
-        status_attempts = 5
+        # only retry a few times, unless the status of some jobs could not
+        # be obtained during the previous check(s), too
+        status_attempts = 5 if self._consecutive_status_misses else 2
 
-        active_jobs_ids = {job_info.external_jobid for job_info in active_jobs}
+        # the ids of the active jobs do not change during a status check
+        active_jobs_ids = frozenset(job_info.external_jobid for job_info in active_jobs)
         active_jobs_seen_by_sacct = set()
         missing_sacct_status = set()
 
-        # We use this sacct syntax for argument 'starttime' to keep it compatible
-        # with slurm < 20.11
-        sacct_starttime = f"{datetime.now() - timedelta(days = 2):%Y-%m-%dT%H:00}"
-        # previously we had
-        # f"--starttime now-2days --endtime now --name {self.run_uuid}"
-        # in line 218 - once v20.11 is definitively not in use any more,
-        # the more readable version ought to be re-adapted
+        # jobs still known to squeue do not need to be queried with sacct
+        status_from_squeue = self.get_squeue_stati(active_jobs_ids)
 
+        # We only query the active jobs by their ids (with '-j', sacct does not
+        # restrict the query to jobs of the current day), in chunks to keep the
+        # command lines short. The run name is still given, such that jobs
+        # with the same id on other clusters or from earlier (wrapped around)
+        # job id ranges are not reported.
         # -X: only show main job, no substeps
-        sacct_command = f"""sacct -X --parsable2 \
-                        --clusters all \
-                        --noheader --format=JobIdRaw,State \
-                        --starttime {sacct_starttime} \
-                        --endtime now --name {self.run_uuid}"""
-
-        # for better redability in verbose output
-        sacct_command = " ".join(shlex.split(sacct_command))
+        jobids = list(active_jobs_ids - status_from_squeue.keys())
+        sacct_commands = [
+            [
+                "sacct",
+                "-X",
+                "--parsable2",
+                "--clusters",
+                "all",
+                "--noheader",
+                "--format=JobIdRaw,State",
+                "--name",
+                self.run_uuid,
+                "-j",
+                ",".join(jobids[start : start + MAX_JOBIDS_PER_COMMAND]),
+            ]
+            for start in range(0, len(jobids), MAX_JOBIDS_PER_COMMAND)
+        ]
 
         # this code is inspired by the snakemake profile:
         # https://github.com/Snakemake-Profiles/slurm
         for i in range(status_attempts):
+            if i:
+                # back off exponentially before retrying, in order to not add
+                # to the load of an already busy slurmdbd
+                await asyncio.sleep(0.5 * 2 ** (i - 1))
             async with self.status_rate_limiter:
-                (status_of_jobs, sacct_query_duration) = await self.job_stati(
-                    sacct_command
-                )
-                if status_of_jobs is None and sacct_query_duration is None:
+                status_of_jobs = dict(status_from_squeue)
+                for sacct_command in sacct_commands:
+                    (chunk_status, sacct_query_duration) = await self.job_stati(
+                        sacct_command
+                    )
+                    if chunk_status is None:
+                        status_of_jobs = None
+                        break
+                    status_of_jobs.update(chunk_status)
+                    sacct_query_durations.append(sacct_query_duration)
+                if status_of_jobs is None:
                     self.logger.debug(f"could not check status of job {self.run_uuid}")
                     continue
-                sacct_query_durations.append(sacct_query_duration)
-                self.logger.debug(f"status_of_jobs after sacct is: {status_of_jobs}")
                 # only take jobs that are still active
                 active_jobs_ids_with_current_sacct_status = (
-                    set(status_of_jobs.keys()) & active_jobs_ids
-                )
-                self.logger.debug(
-                    f"active_jobs_ids_with_current_sacct_status are: "
-                    f"{active_jobs_ids_with_current_sacct_status}"
-                )
-                active_jobs_seen_by_sacct = (
-                    active_jobs_seen_by_sacct
-                    | active_jobs_ids_with_current_sacct_status
-                )
-                self.logger.debug(
-                    f"active_jobs_seen_by_sacct are: {active_jobs_seen_by_sacct}"
+                    status_of_jobs.keys() & active_jobs_ids
                 )
+                active_jobs_seen_by_sacct |= active_jobs_ids_with_current_sacct_status
                 missing_sacct_status = (
                     active_jobs_seen_by_sacct
                     - active_jobs_ids_with_current_sacct_status
                 )
-                self.logger.debug(f"missing_sacct_status are: {missing_sacct_status}")
+                # formatting these collections is costly for thousands of jobs,
+                # hence they are only formatted if debug output is shown
+                if self._debug_logging:
+                    self.logger.debug(
+                        f"status_of_jobs after sacct is: {status_of_jobs}"
+                    )
+                    self.logger.debug(
+                        f"active_jobs_ids_with_current_sacct_status are: "
+                        f"{active_jobs_ids_with_current_sacct_status}"
+                    )
+                    self.logger.debug(
+                        f"active_jobs_seen_by_sacct are: {active_jobs_seen_by_sacct}"
+                    )
+                    self.logger.debug(
+                        f"missing_sacct_status are: {missing_sacct_status}"
+                    )
                 if not missing_sacct_status:
                     break
 
+        if status_of_jobs is None or missing_sacct_status:
+            self._consecutive_status_misses += 1
+        else:
+            self._consecutive_status_misses = 0
+
         if missing_sacct_status:
             self.logger.warning(
                 f"Unable to get the status of all active jobs that should be "
@@ -428,8 +576,13 @@ class Executor(RemoteExecutor):
                 "slurmdbd job accounting is properly set up.\n"
             )
 
-        if status_of_jobs is not None:
-            any_finished = False
+        if status_of_jobs is None:
+            # no status could be obtained at all, the jobs are kept as active
+            # and checked again during the next round
+            for j in active_jobs:
+                yield j
+        else:
+            n_finished = 0
             for j in active_jobs:
                 # the job probably didn't make it into slurmdbd yet, so
                 # `sacct` doesn't return it
@@ -441,7 +594,7 @@ class Executor(RemoteExecutor):
                 status = status_of_jobs[j.external_jobid]
                 if status == "COMPLETED":
                     self.report_job_success(j)
-                    any_finished = True
+                    n_finished += 1
                     active_jobs_seen_by_sacct.remove(j.external_jobid)
                     if not self.workflow.executor_settings.keep_successful_logs:
                         self.logger.debug(
@@ -471,9 +624,9 @@ We leave it to SLURM to resume your job(s)"""
                     # the job probably does not exist anymore, but 'sacct' did not work
                     # so we assume it is finished
                     self.report_job_success(j)
-                    any_finished = True
+                    n_finished += 1
                     active_jobs_seen_by_sacct.remove(j.external_jobid)
-                elif status in fail_stati:
+                elif status in FAIL_STATI:
                     msg = (
                         f"SLURM-job '{j.external_jobid}' failed, SLURM status is: "
                         # message ends with '. ', because it is proceeded
@@ -483,111 +636,302 @@ We leave it to SLURM to resume your job(s)"""
                     self.report_job_error(
                         j, msg=msg, aux_logs=[j.aux["slurm_logfile"]._str]
                     )
+                    n_finished += 1
                     active_jobs_seen_by_sacct.remove(j.external_jobid)
                 else:  # still running?
                     yield j
 
-            if not any_finished:
-                self.next_seconds_between_status_checks = min(
-                    self.next_seconds_between_status_checks + 10, max_sleep_time
-                )
-            else:
-                self.next_seconds_between_status_checks = None
+            # Adapt the time until the next status check to the fraction of
+            # jobs which finished since the last one: the fewer jobs finish,
+            # the longer we wait (up to max_sleep_time). The new interval is
+            # the mean of the previous one and this target, such that a single
+            # finished job does not cause the interval to drop all at once.
+            base_sleep_time = (
+                self.workflow.remote_execution_settings.seconds_between_status_checks
+            )
+            # without active jobs, we return to the base interval, in order to
+            # not miss out on newly submitted jobs
+            finished_fraction = n_finished / len(active_jobs) if active_jobs else 1.0
+            target_sleep_time = min(
+                max(base_sleep_time / max(finished_fraction, 0.05), base_sleep_time),
+                max_sleep_time,
+            )
+            self.next_seconds_between_status_checks = (
+                self.next_seconds_between_status_checks + target_sleep_time
+            ) / 2
+
+    def start_squeue_stream(self):
+        """
+        starts a background 'squeue --iterate' process, whose output is read
+        by a separate thread to keep a snapshot of the current job states
+        """
+        cmd = [
+            "squeue",
+            "--user",
+            os.environ["USER"],
+            "--name",
+            self.run_uuid,
+            "--iterate",
+            str(self.workflow.executor_settings.squeue_interval),
+            "--format=%i|%T",
+        ]
+        # error messages are kept in a temporary file, in order to report
+        # them, should squeue terminate prematurely
+        stderr_file = tempfile.TemporaryFile(mode="w+")
+        try:
+            self._squeue_process = subprocess.Popen(
+                cmd, text=True, stdout=subprocess.PIPE, stderr=stderr_file
+            )
+        except OSError as e:
+            stderr_file.close()
+            self.logger.warning(
+                f"Unable to start '{shlex.join(cmd)}', job states will be "
+                f"queried with sacct only: {e}"
+            )
+            return
+        threading.Thread(
+            target=self.read_squeue_stream,
+            args=(self._squeue_process, stderr_file),
+            daemon=True,
+        ).start()
+
+    def read_squeue_stream(self, process, stderr_file):
+        """
+        reads the output of 'squeue --iterate', each iteration starts with
+        a date and a header line, followed by '<jobid>|<state>' lines
+        """
+        current = None
+        with stderr_file:
+            for line in process.stdout:
+                jobid, sep, state = line.strip().partition("|")
+                if jobid == "JOBID":
+                    # a new iteration starts: its job states are published
+                    # right away and filled in while squeue reports them,
+                    # jobs not listed (yet) are simply queried with sacct
+                    current = {}
+                    self._squeue_snapshot = (current, time.time())
+                elif sep and current is not None:
+                    current[jobid] = state
+            returncode = process.wait()
+            if self._squeue_stopping:
+                return
+            stderr_file.seek(0)
+            stderr = stderr_file.read().strip()
+        self.logger.warning(
+            f"'squeue --iterate' terminated (exit code {returncode}), job "
+            f"states will be queried with sacct only: {stderr}"
+        )
+
+    def get_squeue_stati(self, jobids):
+        """
+        returns the states of the given jobs as reported by the latest
+        'squeue --iterate' iteration, unless this is outdated
+        """
+        if self._squeue_process is None:
+            return {}
+        snapshot, timestamp = self._squeue_snapshot
+        # the snapshot is outdated, if squeue did not report for a while
+        # (e.g. because it terminated), then all jobs are queried with sacct
+        max_age = 2 * self.workflow.executor_settings.squeue_interval
+        if time.time() - timestamp > max_age:
+            return {}
+        return {jobid: snapshot[jobid] for jobid in jobids if jobid in snapshot}
+
+    def shutdown(self):
+        if self._squeue_process is not None:
+            self._squeue_stopping = True
+            self._squeue_process.terminate()
+            self._squeue_process.wait()
+        super().shutdown()
 
     def cancel_jobs(self, active_jobs: List[SubmittedJobInfo]):
         # Cancel all active jobs.
         # This method is called when Snakemake is interrupted.
-        if active_jobs:
-            # TODO chunk jobids in order to avoid too long command lines
-            jobids = " ".join([job_info.external_jobid for job_info in active_jobs])
+        jobids = [job_info.external_jobid for job_info in active_jobs]
+        # the job ids are passed to scancel in chunks, in order to avoid
+        # too long command lines, and the chunks are cancelled concurrently
+        chunks = [
+            jobids[start : start + MAX_JOBIDS_PER_COMMAND]
+            for start in range(0, len(jobids), MAX_JOBIDS_PER_COMMAND)
+        ]
+        with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_SUBMISSIONS) as pool:
+            futures = [pool.submit(self.scancel, chunk) for chunk in chunks]
+        error = None
+        for future in futures:
             try:
-                # timeout set to 60, because a scheduler cycle usually is
-                # about 30 sec, but can be longer in extreme cases.
-                # Under 'normal' circumstances, 'scancel' is executed in
-                # virtually no time.
-                scancel_command = f"scancel {jobids} --clusters=all"
-
-                subprocess.check_output(
-                    scancel_command,
-                    text=True,
-                    shell=True,
-                    timeout=60,
-                    stderr=subprocess.PIPE,
-                )
-            except subprocess.TimeoutExpired:
-                self.logger.warning("Unable to cancel jobs within a minute.")
-            except subprocess.CalledProcessError as e:
-                msg = e.stderr.strip()
-                if msg:
-                    msg = f": {msg}"
-                raise WorkflowError(
-                    "Unable to cancel jobs with scancel "
-                    f"(exit code {e.returncode}){msg}"
-                ) from e
+                future.result()
+            except WorkflowError as e:
+                # all chunks have been tried, before the error is raised
+                error = error or e
+        if error is not None:
+            raise error
+
+    def scancel(self, jobids):
+        """
+        cancels the SLURM jobs with the given ids,
+        raises a WorkflowError if scancel fails
+        """
+        try:
+            # timeout set to 60, because a scheduler cycle usually is
+            # about 30 sec, but can be longer in extreme cases.
+            # Under 'normal' circumstances, 'scancel' is executed in
+            # virtually no time.
+            scancel_command = ["scancel", *jobids, "--clusters=all"]
+
+            # the output of scancel is of no interest, only its
+            # error message is reported upon failure
+            subprocess.run(
+                scancel_command,
+                text=True,
+                timeout=60,
+                check=True,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.PIPE,
+            )
+        except subprocess.TimeoutExpired:
+            self.logger.warning("Unable to cancel jobs within a minute.")
+        except subprocess.CalledProcessError as e:
+            msg = e.stderr.strip()
+            if msg:
+                msg = f": {msg}"
+            raise WorkflowError(
+                f"Unable to cancel jobs with scancel (exit code {e.returncode}){msg}"
+            ) from e
 
     async def job_stati(self, command):
         """Obtain SLURM job status of all submitted jobs with sacct
 
         Keyword arguments:
-        command -- a slurm command that returns one line for each job with:
+        command -- a slurm command (as a list of arguments) that returns one
+                   line for each job with:
                    "<raw/main_job_id>|<long_status_string>"
         """
         res = query_duration = None
         try:
             time_before_query = time.time()
-            command_res = subprocess.check_output(
-                command, text=True, shell=True, stderr=subprocess.PIPE
-            )
+            # the output is parsed line by line while sacct is still running,
+            # rather than holding all of it in memory first; error messages
+            # go to a temporary file, as a second pipe, which is only read
+            # afterwards, could fill up and block sacct
+            status = {}
+            with tempfile.TemporaryFile(mode="w+") as stderr_file, subprocess.Popen(
+                command, text=True, stdout=subprocess.PIPE, stderr=stderr_file
+            ) as process:
+                for line in process.stdout:
+                    jobid, sep, state = line.rstrip("\n").partition("|")
+                    # skip empty lines and lines without a state field
+                    if not sep:
+                        continue
+                    # We split the second field in the output, as the State field
+                    # could contain info beyond the JOB STATE CODE according to:
+                    # https://slurm.schedmd.com/sacct.html#OPT_State
+                    status[jobid] = (
+                        state.split(sep=None, maxsplit=1)[0] if state else ""
+                    )
+                process.wait()
+                stderr_file.seek(0)
+                stderr = stderr_file.read()
+            if process.returncode != 0:
+                raise subprocess.CalledProcessError(
+                    process.returncode, command, stderr=stderr
+                )
             query_duration = time.time() - time_before_query
             self.logger.debug(
-                f"The job status was queried with command: {command}\n"
+                f"The job status was queried with command: {shlex.join(command)}\n"
                 f"It took: {query_duration} seconds\n"
-                f"The output is:\n'{command_res}'\n"
+                f"It reported the status of {len(status)} job(s)\n"
             )
-            res = {
-                # We split the second field in the output, as the State field
-                # could contain info beyond the JOB STATE CODE according to:
-                # https://slurm.schedmd.com/sacct.html#OPT_State
-                entry[0]: entry[1].split(sep=None, maxsplit=1)[0]
-                for entry in csv.reader(StringIO(command_res), delimiter="|")
-            }
-        except subprocess.CalledProcessError as e:
+            res = status
+        except (subprocess.CalledProcessError, OSError) as e:
             self.logger.error(
-                f"The job status query failed with command: {command}\n"
-                f"Error message: {e.stderr.strip()}\n"
+                f"The job status query failed with command: {shlex.join(command)}\n"
+                f"Error message: {str(getattr(e, 'stderr', e)).strip()}\n"
             )
             pass
 
         return (res, query_duration)
 
+    def prefetch_slurm_metadata(self, jobs: List[JobExecutorInterface]):
+        """
+        runs the account and partition lookups needed for the given jobs
+        at the same time, instead of one after the other upon first use
+        """
+        guess_account = self._fallback_account_arg is None and any(
+            not job.resources.get("slurm_account") for job in jobs
+        )
+        # the accounts are only needed, if any account is going to be tested
+        query_accounts = self._valid_accounts is None and (
+            guess_account or any(job.resources.get("slurm_account") for job in jobs)
+        )
+        # one job per cluster specification in need of a default partition
+        partition_jobs = {}
+        for job in jobs:
+            clusters = job.resources.get("clusters") or None
+            if (
+                not job.resources.get("slurm_partition")
+                and clusters not in self._fallback_partitions
+            ):
+                partition_jobs.setdefault(clusters, job)
+        lookups = guess_account + query_accounts + len(partition_jobs)
+        if lookups < 2:
+            # nothing to gain, the lookups take place upon first use
+            return
+
+        with ThreadPoolExecutor(max_workers=lookups) as pool:
+            account_guess = pool.submit(self.get_account) if guess_account else None
+            valid_accounts = (
+                pool.submit(self.get_valid_accounts, None) if query_accounts else None
+            )
+            default_partitions = {
+                clusters: pool.submit(self.get_default_partition, job, clusters)
+                for clusters, job in partition_jobs.items()
+            }
+        if valid_accounts is not None:
+            try:
+                self._valid_accounts = valid_accounts.result()
+            except WorkflowError:
+                # the error is raised again (naming the account in question),
+                # when the first account gets tested
+                pass
+        for clusters, default_partition in default_partitions.items():
+            self._fallback_partitions[clusters] = default_partition.result()
+        if account_guess is not None:
+            self.set_fallback_account(account_guess.result())
+
     def get_account_arg(self, job: JobExecutorInterface):
         """
         checks whether the desired account is valid,
         returns a default account, if applicable
         else raises an error - implicetly.
         """
-        if job.resources.get("slurm_account"):
+        account = job.resources.get("slurm_account")
+        if account:
+            # resources are evaluated, hence a numeric account is no string
+            account = str(account)
             # here, we check whether the given or guessed account is valid
             # if not, a WorkflowError is raised
-            self.test_account(job.resources.slurm_account)
-            return f" -A '{job.resources.slurm_account}'"
+            self.test_account(account)
+            return ["-A", account]
         else:
             if self._fallback_account_arg is None:
-                self.logger.warning("No SLURM account given, trying to guess.")
-                account = self.get_account()
-                if account:
-                    self.logger.warning(f"Guessed SLURM account: {account}")
-                    self.test_account(f"{account}")
-                    self._fallback_account_arg = f" -A {account}"
-                else:
-                    self.logger.warning(
-                        "Unable to guess SLURM account. Trying to proceed without."
-                    )
-                    self._fallback_account_arg = (
-                        ""  # no account specific args for sbatch
-                    )
+                self.set_fallback_account(self.get_account())
             return self._fallback_account_arg
 
+    def set_fallback_account(self, account):
+        """
+        tests the guessed account (if any) and stores the
+        respective sbatch arguments for all jobs without an account
+        """
+        if account:
+            self.logger.warning(f"Guessed SLURM account: {account}")
+            self.test_account(f"{account}")
+            self._fallback_account_arg = ["-A", account]
+        else:
+            self.logger.warning(
+                "Unable to guess SLURM account. Trying to proceed without."
+            )
+            self._fallback_account_arg = []  # no account specific args
+
     def get_partition_arg(self, job: JobExecutorInterface):
         """
         checks whether the desired partition is valid,
@@ -597,29 +941,35 @@ We leave it to SLURM to resume your job(s)"""
         if job.resources.get("slurm_partition"):
             partition = job.resources.slurm_partition
         else:
-            if self._fallback_partition is None:
-                self._fallback_partition = self.get_default_partition(job)
-            partition = self._fallback_partition
+            clusters = job.resources.get("clusters") or None
+            if clusters not in self._fallback_partitions:
+                self._fallback_partitions[clusters] = self.get_default_partition(
+                    job, clusters
+                )
+            partition = self._fallback_partitions[clusters]
         if partition:
-            return f" -p {partition}"
+            return ["-p", str(partition)]
         else:
-            return ""
+            return []
 
     def get_account(self):
         """
         tries to deduce the acccount from recent jobs,
         returns None, if none is found
         """
-        cmd = f'sacct -nu "{os.environ["USER"]}" -o Account%256 | head -n1'
+        self.logger.warning("No SLURM account given, trying to guess.")
+        cmd = ["sacct", "-nu", os.environ["USER"], "-o", "Account%256"]
         try:
-            sacct_out = subprocess.check_output(
-                cmd, shell=True, text=True, stderr=subprocess.PIPE
-            )
-            return sacct_out.replace("(null)", "").strip()
-        except subprocess.CalledProcessError as e:
+            sacct_out = subprocess.run(
+                cmd, text=True, capture_output=True, check=True
+            ).stdout
+            # only the most recent job is of interest
+            first_line = sacct_out.split("\n", 1)[0]
+            return first_line.replace("(null)", "").strip()
+        except (subprocess.CalledProcessError, OSError) as e:
             self.logger.warning(
                 f"No account was given, not able to get a SLURM account via sacct: "
-                f"{e.stderr}"
+                f"{getattr(e, 'stderr', e)}"
             )
             return None
 
@@ -627,25 +977,53 @@ We leave it to SLURM to resume your job(s)"""
         """
         tests whether the given account is registered, raises an error, if not
         """
-        cmd = f'sacctmgr -n -s list user "{os.environ["USER"]}" format=account%256'
-        try:
-            accounts = subprocess.check_output(
-                cmd, shell=True, text=True, stderr=subprocess.PIPE
+        if self._valid_accounts is None:
+            self._valid_accounts = self.get_valid_accounts(account)
+
+        if str(account).lower() not in self._valid_accounts:
+            raise WorkflowError(
+                f"The given account {account} appears to be invalid. Available "
+                f"accounts:\n{', '.join(self._valid_accounts)}"
             )
-        except subprocess.CalledProcessError as e:
+
+    def get_valid_accounts(self, account):
+        """
+        returns the set of SLURM accounts of the user, the account in question
+        is only used for error reporting
+        """
+        cmd = [
+            "sacctmgr",
+            "-n",
+            "-s",
+            "list",
+            "user",
+            os.environ["USER"],
+            "format=account%256",
+        ]
+        try:
+            accounts = subprocess.run(
+                cmd, text=True, capture_output=True, check=True
+            ).stdout
+            sacctmgr_report = "no accounts listed for the user."
+        except (subprocess.CalledProcessError, OSError) as e:
+            accounts = ""
             sacctmgr_report = (
                 "Unable to test the validity of the given or guessed "
-                f"SLURM account '{account}' with sacctmgr: {e.stderr}."
+                f"SLURM account '{account}' with sacctmgr: "
+                f"{getattr(e, 'stderr', e)}."
             )
+        # sshare is only asked, if sacctmgr did not yield any account
+        if not accounts.strip():
             try:
-                cmd = "sshare -U --format Account --noheader"
-                accounts = subprocess.check_output(
-                    cmd, shell=True, text=True, stderr=subprocess.PIPE
-                )
-            except subprocess.CalledProcessError as e2:
+                cmd = ["sshare", "-U", "--format", "Account", "--noheader"]
+                accounts = subprocess.run(
+                    cmd, text=True, capture_output=True, check=True
+                ).stdout
+            except (subprocess.CalledProcessError, OSError) as e2:
                 sshare_report = (
                     "Unable to test the validity of the given or guessed"
-                    f" SLURM account '{account}' with sshare: {e2.stderr}."
+                    f" SLURM account '{account}' with sshare: "
+                    f"{getattr(e2, 'stderr', e2)}."
                 )
                 raise WorkflowError(
                     f"The 'sacctmgr' reported: '{sacctmgr_report}' "
@@ -654,26 +1032,26 @@ We leave it to SLURM to resume your job(s)"""
 
         # The set() has been introduced during review to eliminate
         # duplicates. They are not harmful, but disturbing to read.
-        accounts = set(_.strip() for _ in accounts.split("\n") if _)
-
-        if account not in accounts:
-            raise WorkflowError(
-                f"The given account {account} appears to be invalid. Available "
-                f"accounts:\n{', '.join(accounts)}"
-            )
+        # SLURM account names are case insensitive, hence they are
+        # compared in lower case.
+        return set(
+            line.strip().lower() for line in accounts.splitlines() if line.strip()
+        )
 
-    def get_default_partition(self, job):
+    def get_default_partition(self, job, clusters=None):
         """
         if no partition is given, checks whether a fallback onto a default
-        partition is possible
+        partition (of the given clusters, if any) is possible
         """
+        cmd = ["sinfo", "-o", "%P"]
+        if clusters:
+            cmd += ["--clusters", str(clusters)]
         try:
-            out = subprocess.check_output(
-                r"sinfo -o %P", shell=True, text=True, stderr=subprocess.PIPE
-            )
-        except subprocess.CalledProcessError as e:
+            out = subprocess.run(cmd, text=True, capture_output=True, check=True).stdout
+        except (subprocess.CalledProcessError, OSError) as e:
             raise WorkflowError(
-                f"Failed to run sinfo for retrieval of cluster partitions: {e.stderr}"
+                "Failed to run sinfo for retrieval of cluster partitions: "
+                f"{getattr(e, 'stderr', e)}"
             )
         for partition in out.split():
             # A default partition is marked with an asterisk, but this is not part of
@@ -690,9 +1068,15 @@ We leave it to SLURM to resume your job(s)"""
         )
         return ""
 
-    def check_slurm_extra(self, job):
-        jobname = re.compile(r"--job-name[=?|\s+]|-J\s?")
-        if re.search(jobname, job.resources.slurm_extra):
+    def check_slurm_extra(self, slurm_extra_args):
+        # scan the individual flags, this covers '--job-name=<name>',
+        # '--job-name <name>', '-J<name>' and '-J <name>' alike
+        if any(
+            token == "--job-name"
+            or token.startswith("--job-name=")
+            or token.startswith("-J")
+            for token in slurm_extra_args
+        ):
             raise WorkflowError(
                 "The --job-name option is not allowed in the 'slurm_extra' "
                 "parameter. The job name is set by snakemake and must not be "
@@ -18,3 +18,8 @@ class TestWorkflows(snakemake.common.tests.TestWorkflowsLocalStorageBase):
 class TestWorkflowsRequeue(TestWorkflows):
     def get_executor_settings(self) -> Optional[ExecutorSettingsBase]:
         return ExecutorSettings(requeue=True)
+
+
+class TestWorkflowsSqueue(TestWorkflows):
+    def get_executor_settings(self) -> Optional[ExecutorSettingsBase]:
+        return ExecutorSettings(squeue_interval=10)